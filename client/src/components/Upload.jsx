@@ -223,7 +223,7 @@ export default function Upload() {
       {!error && !loading && !checking && online && !modelPresent && (
         <div className="mt-4 card border-amber-200 bg-amber-50 p-4 text-amber-800">
           <p className="font-medium">Model not found</p>
-          <p className="text-sm">Train the model to create <code>server/model/mango_model.h5</code> before running detection.</p>
+          <p className="text-sm">Train the model to create <code>server/model/mango_model.keras</code> before running detection.</p>
         </div>
       )}
 
@@ -39,7 +39,7 @@ Write-Host ""
 # Check model files
 Write-Host "🤖 Checking model files..." -ForegroundColor Yellow
 $modelFiles = @(
-    "server\model\mango_model.h5",
+    "server\model\mango_model.keras",
     "server\model\models\svm.pkl",
     "server\model\models\rf.pkl",
     "server\model\model_comparison.json"
@@ -1,6 +1,6 @@
 from flask import Flask
 from flask_cors import CORS
-from routes.detect import detect_bp
+from routes.detect import detect_bp, init_app
 import os
 
 app = Flask(__name__)
@@ -12,6 +12,7 @@ allowed_origins = os.getenv('CORS_ORIGINS', '*')
 CORS(app, resources={r"/api/*": {"origins": allowed_origins}})
 
 app.register_blueprint(detect_bp, url_prefix='/api')
+init_app(app)
 
 if __name__ == '__main__':
     # Development mode
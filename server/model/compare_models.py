@@ -1,7 +1,7 @@
 """
 Train and compare CNN vs SVM vs RandomForest on the same dataset split.
 
-This script assumes a trained CNN exists at server/model/mango_model.h5 and uses its
+This script assumes a trained CNN exists at server/model/mango_model.keras and uses its
 penultimate layer as a feature extractor for classical models (SVM, RandomForest).
 
 Outputs:
@@ -24,22 +24,30 @@ import numpy as np
 import tensorflow as tf
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 from sklearn.svm import SVC
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDClassifier
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 import joblib
 
+from keras_utils import build_feature_extractor, predict_classes
+
 
 THIS_DIR = Path(__file__).resolve().parent
 ROOT = THIS_DIR.parent.parent
 DEFAULT_DATASET_DIR = (ROOT / 'dataset').resolve()
 MODEL_DIR = THIS_DIR
-CNN_MODEL_PATH = MODEL_DIR / 'mango_model.h5'
+CNN_MODEL_PATH = MODEL_DIR / 'mango_model.keras'
 METRICS_DIR = MODEL_DIR / 'metrics'
 MODELS_DIR = MODEL_DIR / 'models'
 COMPARISON_JSON = METRICS_DIR / 'model_comparison.json'
 BEST_JSON = MODEL_DIR / 'best_model.json'
 LABELS_JSON = MODEL_DIR / 'class_indices.json'
+RF_PATH = MODELS_DIR / 'rf.pkl'
+# Trees added per warm-start round; the forest never grows past their sum (300)
+RF_CHUNKS = (64, 66, 64, 66, 40)
+RF_MAX_TREES = sum(RF_CHUNKS)
 
 
 def build_argparser():
@@ -48,9 +56,21 @@ def build_argparser():
     p.add_argument('--img-size', type=int, nargs=2, default=[224, 224], metavar=('H', 'W'))
     p.add_argument('--batch-size', type=int, default=32)
     p.add_argument('--seed', type=int, default=123)
+    p.add_argument('--svm', choices=['nystroem', 'rbf'], default='nystroem',
+                   help='SVM variant: Nystroem RBF approximation + SGD (fast) or exact libsvm RBF SVC')
+    p.add_argument('--rf-warm-start', action='store_true',
+                   help='Continue growing the previously saved RandomForest (up to 300 trees) instead of starting from scratch')
     return p
 
 
+def _to_uint8(x, y):
+    # Images stay uint8 until the model's Rescaling layer, which casts on device (4x fewer bytes).
+    # Rounding the bilinear-resized pixels is deliberate: the API decodes and resizes with PIL to
+    # uint8, so the SVM/RF are fitted on the same integer pixels they see when serving. The
+    # difference from the float pixels the CNN trained on is at most 0.5/255 per channel.
+    return tf.saturate_cast(tf.round(x), tf.uint8), y
+
+
 def load_dataset(data_dir: Path, img_size: Tuple[int, int], batch_size: int, seed: int):
     h, w = img_size
     train_ds = tf.keras.utils.image_dataset_from_directory(
@@ -72,55 +92,31 @@ def load_dataset(data_dir: Path, img_size: Tuple[int, int], batch_size: int, see
         label_mode='int',
     )
     class_names = train_ds.class_names
-    # Unbatch to arrays
-    X_train, y_train = [], []
-    for xb, yb in train_ds:
-        X_train.append(xb.numpy())
-        y_train.append(yb.numpy())
-    X_val, y_val = [], []
-    for xb, yb in val_ds:
-        X_val.append(xb.numpy())
-        y_val.append(yb.numpy())
-    X_train = np.concatenate(X_train, axis=0)
-    y_train = np.concatenate(y_train, axis=0)
-    X_val = np.concatenate(X_val, axis=0)
-    y_val = np.concatenate(y_val, axis=0)
-    return (X_train, y_train), (X_val, y_val), class_names
-
-
-def build_feature_extractor(cnn_model: tf.keras.Model) -> tf.keras.Model:
-    # Use the penultimate layer (before final Dense) as features
-    # Typically model.layers[-1] is Dense(num_classes) and model.layers[-2] is Dropout or Dense(128)
-    # We want the last Dense(128) output; find the last Dense with units != num_classes
-    # Fallback: use layers[-2]
-    penultimate = None
-    for layer in reversed(cnn_model.layers):
-        if isinstance(layer, tf.keras.layers.Dense):
-            # Heuristic: pick first Dense encountered from end that is not the final classification layer
-            penultimate = layer
-            break
-    if penultimate is None:
-        output_tensor = cnn_model.layers[-2].output
-    else:
-        output_tensor = penultimate.output
-    return tf.keras.Model(inputs=cnn_model.input, outputs=output_tensor)
-
-
-def extract_features(model: tf.keras.Model, X: np.ndarray, batch_size: int = 64) -> np.ndarray:
-    # The CNN includes rescaling/augmentation internally; ensure X is float32 in 0..255 space
-    Xf = X.astype('float32')
-    feats = model.predict(Xf, batch_size=batch_size, verbose=0)
-    return feats
-
-
-def evaluate_cnn(cnn_model: tf.keras.Model, X_val: np.ndarray, y_val: np.ndarray) -> Dict[str, Any]:
-    logits = cnn_model.predict(X_val, verbose=0)
-    if logits.shape[-1] == 1:
-        probs = tf.sigmoid(logits).numpy().reshape(-1)
-        y_pred = (probs >= 0.5).astype(int)
-    else:
-        probs = tf.nn.softmax(logits, axis=-1).numpy()
-        y_pred = np.argmax(probs, axis=-1)
+    n_train, n_val = len(train_ds.file_paths), len(val_ds.file_paths)
+    # Stream batches instead of materializing X_train/X_val in memory
+    AUTOTUNE = tf.data.AUTOTUNE
+    train_ds = train_ds.map(_to_uint8, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    val_ds = val_ds.map(_to_uint8, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    return train_ds, val_ds, class_names, n_train, n_val
+
+
+def extract_features(model: tf.keras.Model, ds: tf.data.Dataset, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    # The CNN includes rescaling internally; the dataset yields uint8 in 0..255 space.
+    # Labels are gathered in the same pass because the split datasets reshuffle on every iteration.
+    # Outputs are written batch-by-batch into pre-sized buffers instead of concatenated at the end.
+    Z = np.empty((n, model.output_shape[-1]), dtype=np.float32)
+    y = np.empty(n, dtype=np.int64)
+    off = 0
+    for xb, yb in ds:
+        k = int(xb.shape[0])
+        Z[off:off + k] = model(xb, training=False).numpy()
+        y[off:off + k] = yb.numpy()
+        off += k
+    return Z[:off], y[:off]
+
+
+def evaluate_cnn(cnn_model: tf.keras.Model, val_ds: tf.data.Dataset) -> Dict[str, Any]:
+    y_val, y_pred = predict_classes(cnn_model, val_ds)
     acc = float(accuracy_score(y_val, y_pred))
     labels = sorted(list(set(y_val.tolist()) | set(y_pred.tolist())))
     report = classification_report(y_val, y_pred, output_dict=True, labels=labels, zero_division=0)
@@ -128,6 +124,43 @@ def evaluate_cnn(cnn_model: tf.keras.Model, X_val: np.ndarray, y_val: np.ndarray
     return {"accuracy": acc, "report": report, "confusion_matrix": cm}
 
 
+def build_svm(kind: str, n_features: int, seed: int) -> Pipeline:
+    if kind == 'rbf':
+        # No probability=True: it adds an internal 5-fold Platt scaling fit. A larger kernel
+        # cache keeps the kernel matrix in memory during SMO iterations.
+        return Pipeline([
+            ('scaler', StandardScaler()),
+            ('svc', SVC(kernel='rbf', C=1.0, gamma='scale', probability=False, cache_size=1000, random_state=seed)),
+        ])
+    # Approximate RBF kernel + linear SGD head: O(n) fit instead of libsvm's O(n^2)-O(n^3).
+    # gamma=1/d matches gamma='scale' on standardized features; log loss keeps predict_proba
+    # available for the server's confidence scores.
+    return Pipeline([
+        ('scaler', StandardScaler()),
+        ('rbf', Nystroem(kernel='rbf', gamma=1.0 / n_features, n_components=512, random_state=seed)),
+        ('sgd', SGDClassifier(loss='log_loss', n_jobs=-1, random_state=seed)),
+    ])
+
+
+def fit_random_forest(Z_train: np.ndarray, y_train: np.ndarray, seed: int,
+                      rf: RandomForestClassifier | None = None, tol: float = 1e-3) -> RandomForestClassifier:
+    # Grow the forest in chunks (warm start) and stop once the OOB score plateaus
+    if rf is None:
+        rf = RandomForestClassifier(n_estimators=0, warm_start=True, oob_score=True, n_jobs=-1, random_state=seed)
+    # A loaded forest (--rf-warm-start) keeps its trees, but its old oob_score_ came from the
+    # previous run's data, so the plateau test starts fresh
+    prev_oob = None
+    for chunk in RF_CHUNKS:
+        if rf.n_estimators >= RF_MAX_TREES:
+            break
+        rf.n_estimators = min(rf.n_estimators + chunk, RF_MAX_TREES)
+        rf.fit(Z_train, y_train)
+        if prev_oob is not None and rf.oob_score_ - prev_oob < tol:
+            break
+        prev_oob = rf.oob_score_
+    return rf
+
+
 def evaluate_sklearn_model(model, X_val: np.ndarray, y_val: np.ndarray) -> Dict[str, Any]:
     y_pred = model.predict(X_val)
     acc = float(accuracy_score(y_val, y_pred))
@@ -147,28 +180,39 @@ def main():
     if not CNN_MODEL_PATH.exists():
         raise SystemExit(f"CNN model not found: {CNN_MODEL_PATH}. Train it first.")
 
-    (X_train, y_train), (X_val, y_val), class_names = load_dataset(data_dir, img_size, batch, seed)
+    train_ds, val_ds, class_names, n_train, n_val = load_dataset(data_dir, img_size, batch, seed)
     # Load CNN and build feature extractor
     cnn = tf.keras.models.load_model(str(CNN_MODEL_PATH), compile=False)
     feat_extractor = build_feature_extractor(cnn)
 
-    # Extract features
-    Z_train = extract_features(feat_extractor, X_train)
-    Z_val = extract_features(feat_extractor, X_val)
+    # Extract features for train+val in one pass, then split back
+    Z_all, y_all = extract_features(feat_extractor, train_ds.concatenate(val_ds), n_train + n_val)
+    Z_train, Z_val = Z_all[:n_train], Z_all[n_train:]
+    y_train, y_val = y_all[:n_train], y_all[n_train:]
 
     # Build classical models
-    svm = Pipeline([
-        ('scaler', StandardScaler()),
-        ('svc', SVC(kernel='rbf', C=1.0, gamma='scale', probability=True, random_state=seed)),
-    ])
-    rf = RandomForestClassifier(n_estimators=300, random_state=seed)
+    svm = build_svm(args.svm, Z_train.shape[1], seed)
+    prev_rf = None
+    if args.rf_warm_start and RF_PATH.exists():
+        prev_rf = joblib.load(RF_PATH)
+        if not getattr(prev_rf, 'warm_start', False):
+            print(f'{RF_PATH} was not trained with warm_start; fitting a new forest.')
+            prev_rf = None
+        elif getattr(prev_rf, 'n_features_in_', None) != Z_train.shape[1]:
+            print(f'{RF_PATH} was fitted on {getattr(prev_rf, "n_features_in_", "?")} features, '
+                  f'the CNN now produces {Z_train.shape[1]}; fitting a new forest.')
+            prev_rf = None
+        elif prev_rf.n_estimators >= RF_MAX_TREES:
+            print(f'{RF_PATH} already has {prev_rf.n_estimators} trees (max {RF_MAX_TREES}); '
+                  'nothing to add, fitting a new forest.')
+            prev_rf = None
 
     # Fit
     svm.fit(Z_train, y_train)
-    rf.fit(Z_train, y_train)
+    rf = fit_random_forest(Z_train, y_train, seed, prev_rf)
 
     # Evaluate
-    res_cnn = evaluate_cnn(cnn, X_val, y_val)
+    res_cnn = evaluate_cnn(cnn, val_ds)
     res_svm = evaluate_sklearn_model(svm, Z_val, y_val)
     res_rf = evaluate_sklearn_model(rf, Z_val, y_val)
 
@@ -186,9 +230,10 @@ def main():
     METRICS_DIR.mkdir(parents=True, exist_ok=True)
     MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Save sklearn models
-    joblib.dump(svm, MODELS_DIR / 'svm.pkl')
-    joblib.dump(rf, MODELS_DIR / 'rf.pkl')
+    # Save sklearn models uncompressed with pickle protocol 5, so the API can memory-map
+    # their arrays instead of decompressing and copying them on load
+    joblib.dump(svm, MODELS_DIR / 'svm.pkl', compress=0, protocol=5)
+    joblib.dump(rf, RF_PATH, compress=0, protocol=5)
 
     # Save comparison
     comparison_payload = {
@@ -22,6 +22,8 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.metrics import confusion_matrix, classification_report, accuracy_score
 
+from keras_utils import has_rescaling, predict_classes
+
 THIS_DIR = Path(__file__).resolve().parent
 METRICS_DIR = THIS_DIR / 'metrics'
 
@@ -33,7 +35,7 @@ def build_argparser():
     p.add_argument('--batch-size', type=int, default=32)
     p.add_argument('--split', choices=['validation', 'training', 'full'], default='validation',
                    help='Which split to evaluate. If full, uses all data without split.')
-    p.add_argument('--model', type=Path, default=(THIS_DIR / 'mango_model.h5'))
+    p.add_argument('--model', type=Path, default=(THIS_DIR / 'mango_model.keras'))
     return p
 
 
@@ -52,8 +54,17 @@ def load_dataset(data_dir: Path, img_size: tuple[int, int], batch_size: int, spl
         return ds
 
 
-def plot_confusion_matrix(y_true, y_pred, class_names, out_png: Path):
-    cm = confusion_matrix(y_true, y_pred)
+def _preproc(x, y):
+    # Ship uint8 to the model (4x fewer bytes); its Rescaling layer casts on device
+    return tf.saturate_cast(tf.round(x), tf.uint8), y
+
+
+def _preproc_scaled(x, y):
+    # Model has no Rescaling layer: scale 0..255 input to 0..1 in the pipeline
+    return tf.cast(x, tf.float32) / 255.0, y
+
+
+def plot_confusion_matrix(cm, class_names, out_png: Path):
     plt.figure(figsize=(5, 4))
     sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=class_names, yticklabels=class_names)
     plt.xlabel('Predicted')
@@ -64,31 +75,21 @@ def plot_confusion_matrix(y_true, y_pred, class_names, out_png: Path):
     plt.close()
 
 
-def plot_class_distribution(ds, out_png: Path):
-    # Collect labels from dataset
-    labels = []
-    for _, y in ds:
-        labels.extend(y.numpy().tolist())
-    labels = np.array(labels)
-    counts = [(labels == i).sum() for i in range(len(ds.class_names))]
+def plot_class_distribution(y_true, class_names, out_png: Path):
+    # Count labels already collected during prediction (no second pass over the dataset)
+    counts = np.bincount(y_true, minlength=len(class_names))
     plt.figure(figsize=(5, 4))
-    plt.pie(counts, labels=ds.class_names, autopct='%1.1f%%', startangle=140)
+    plt.pie(counts, labels=class_names, autopct='%1.1f%%', startangle=140)
     plt.title('Class Distribution')
     plt.tight_layout()
     plt.savefig(out_png)
     plt.close()
 
 
-def plot_per_class_accuracy(y_true, y_pred, class_names, out_png: Path):
-    y_true = np.array(y_true)
-    y_pred = np.array(y_pred)
-    accs = []
-    for i, _ in enumerate(class_names):
-        mask = (y_true == i)
-        if mask.any():
-            accs.append((y_pred[mask] == i).mean())
-        else:
-            accs.append(0.0)
+def plot_per_class_accuracy(cm, class_names, out_png: Path):
+    # Per-class accuracy (recall) straight from the confusion matrix rows
+    row_sums = cm.sum(axis=1)
+    accs = np.where(row_sums > 0, cm.diagonal() / np.maximum(row_sums, 1), 0.0)
     plt.figure(figsize=(6, 4))
     plt.bar(class_names, [a * 100 for a in accs], color=['#f59e0b', '#16a34a', '#3b82f6', '#ef4444'][:len(class_names)])
     plt.ylabel('Accuracy (%)')
@@ -116,24 +117,13 @@ def main():
     model = tf.keras.models.load_model(str(model_path), compile=False)
 
     # Ensure preprocessing consistent with training
-    # If model expects [0,1] scaling and includes a Rescaling layer, inference will still work.
-    y_true_all = []
-    y_pred_all = []
-    for x_batch, y_batch in ds:
-        # Convert to float32 to avoid dtype issues
-        x_batch = tf.cast(x_batch, tf.float32)
-        # If values seem 0..255, scale to 0..1 for robustness
-        if tf.reduce_max(x_batch) > 1.5:
-            x_batch = x_batch / 255.0
-        logits = model.predict(x_batch, verbose=0)
-        if logits.shape[-1] == 1:
-            # Binary head
-            probs1 = tf.squeeze(tf.sigmoid(logits), axis=-1).numpy()
-            preds = (probs1 >= 0.5).astype(int)
-        else:
-            preds = tf.argmax(logits, axis=-1).numpy()
-        y_true_all.extend(y_batch.numpy().tolist())
-        y_pred_all.extend(preds.tolist())
+    # The trained model includes a Rescaling layer and consumes raw 0..255 input;
+    # only scale in the pipeline when that layer is absent (decided once, not per batch).
+    AUTOTUNE = tf.data.AUTOTUNE
+    preproc = _preproc if has_rescaling(model) else _preproc_scaled
+    pred_ds = ds.map(preproc, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    # One pass: predictions and labels together, so the dataset is decoded only once
+    y_true_all, y_pred_all = predict_classes(model, pred_ds)
 
     acc = accuracy_score(y_true_all, y_pred_all)
     # Ensure classification_report includes all classes even if some are absent in y_true
@@ -160,9 +150,10 @@ def main():
     (METRICS_DIR / 'metrics.json').write_text(json.dumps(metrics, indent=2))
 
     # Plots
-    plot_confusion_matrix(y_true_all, y_pred_all, class_names, METRICS_DIR / 'confusion_matrix.png')
-    plot_class_distribution(ds, METRICS_DIR / 'class_distribution_pie.png')
-    plot_per_class_accuracy(y_true_all, y_pred_all, class_names, METRICS_DIR / 'per_class_accuracy_bar.png')
+    cm = confusion_matrix(y_true_all, y_pred_all, labels=labels)
+    plot_confusion_matrix(cm, class_names, METRICS_DIR / 'confusion_matrix.png')
+    plot_class_distribution(y_true_all, class_names, METRICS_DIR / 'class_distribution_pie.png')
+    plot_per_class_accuracy(cm, class_names, METRICS_DIR / 'per_class_accuracy_bar.png')
 
     print('\nEvaluation complete. Outputs saved under:', METRICS_DIR)
 
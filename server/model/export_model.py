@@ -0,0 +1,131 @@
+"""
+Export the trained CNN for serving.
+
+Writes a SavedModel directory that the API loads in preference to the .keras file.
+It exposes two signatures sharing the same weights, both taking a float32 [N, H, W, 3]
+batch in 0..255 (any input scaling is baked in):
+  - serving_default: {'probs': class probabilities}
+  - multi: {'probs', 'features'} from a single forward pass; 'features' are the penultimate
+    Dense activations used by the SVM/RF models
+
+With --tflite, also converts the multi signature to mango_model.tflite for lean CPU inference
+(preferred by the API).
+
+With --int8, also writes a full-integer post-training quantized variant calibrated on --data-dir
+(mango_model_int8.tflite). It takes uint8 input quantized with the input tensor's calibrated
+scale/zero_point (the API applies them to raw pixels) and is preferred by the API over the
+float model; delete it to fall back if accuracy regresses.
+
+Usage (from repo root or server/model):
+  python server/model/export_model.py --model server/model/mango_model.keras --out server/model/mango_saved --tflite
+  python server/model/export_model.py --tflite --int8 --data-dir ./dataset
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import tensorflow as tf
+
+from keras_utils import build_feature_extractor, has_rescaling
+
+
+THIS_DIR = Path(__file__).resolve().parent
+DEFAULT_DATASET_DIR = (THIS_DIR.parent.parent / 'dataset').resolve()
+DEFAULT_MODEL = THIS_DIR / 'mango_model.keras'
+DEFAULT_SAVED_DIR = THIS_DIR / 'mango_saved'
+TFLITE_MODEL = THIS_DIR / 'mango_model.tflite'
+TFLITE_MODEL_INT8 = THIS_DIR / 'mango_model_int8.tflite'
+
+
+def build_argparser():
+    p = argparse.ArgumentParser(description='Export the mango CNN as a SavedModel for serving.')
+    p.add_argument('--model', type=Path, default=DEFAULT_MODEL, help='Trained Keras model')
+    p.add_argument('--out', type=Path, default=DEFAULT_SAVED_DIR, help='Output SavedModel directory')
+    p.add_argument('--tflite', action='store_true', help='Also export TensorFlow Lite models')
+    p.add_argument('--int8', action='store_true', help='Also export INT8-quantized TensorFlow Lite models')
+    p.add_argument('--data-dir', type=Path, default=DEFAULT_DATASET_DIR,
+                   help='Dataset used to calibrate INT8 quantization')
+    p.add_argument('--calib-samples', type=int, default=100, help='Number of calibration images for INT8')
+    return p
+
+
+def export_saved_model(cnn: tf.keras.Model, out_dir: Path) -> None:
+    feat_extractor = build_feature_extractor(cnn)
+    # One graph with both heads, so probabilities and features cost a single forward pass
+    multi_model = tf.keras.Model(inputs=cnn.input, outputs=[cnn.output, feat_extractor.output])
+    needs_scale = not has_rescaling(cnn)
+    _, h, w, c = cnn.inputs[0].shape
+    spec = tf.TensorSpec([None, h, w, c], tf.float32, name='x')
+
+    module = tf.Module()
+    module.cnn = cnn
+    module.multi_model = multi_model
+
+    def _scale(x):
+        return x / 255.0 if needs_scale else x
+
+    @tf.function(input_signature=[spec])
+    def serve(x):
+        return {'probs': cnn(_scale(x), training=False)}
+
+    @tf.function(input_signature=[spec])
+    def multi(x):
+        probs, features = multi_model(_scale(x), training=False)
+        return {'probs': probs, 'features': features}
+
+    tf.saved_model.save(module, str(out_dir), signatures={'serving_default': serve, 'multi': multi})
+
+
+def representative_images(data_dir: Path, img_size: tuple[int, int], count: int):
+    ds = tf.keras.utils.image_dataset_from_directory(
+        data_dir, image_size=img_size, batch_size=1, label_mode=None, shuffle=True, seed=123
+    )
+
+    def gen():
+        for x in ds.take(count):
+            yield [tf.cast(x, tf.float32)]
+    return gen
+
+
+def convert_tflite(saved_dir: Path, out_path: Path, representative_data=None) -> None:
+    # Converting the named signature keeps 'probs'/'features' addressable by name in the
+    # interpreter's signature runner
+    converter = tf.lite.TFLiteConverter.from_saved_model(str(saved_dir), signature_keys=['multi'])
+    if representative_data is not None:
+        # Full-integer post-training quantization with uint8 input. The input scale/zero_point come
+        # from calibration; the API quantizes raw 0..255 pixels with them (see _tflite_fns)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_data
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+    else:
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+    out_path.write_bytes(converter.convert())
+
+
+def main():
+    args = build_argparser().parse_args()
+    model_path = args.model.resolve()
+    if not model_path.exists():
+        raise SystemExit(f'Model not found: {model_path}. Train first.')
+    cnn = tf.keras.models.load_model(str(model_path), compile=False)
+    saved_dir = args.out.resolve()
+    export_saved_model(cnn, saved_dir)
+    print(f'SavedModel exported to: {args.out}')
+    if args.tflite:
+        convert_tflite(saved_dir, TFLITE_MODEL)
+        print(f'TFLite model exported to: {TFLITE_MODEL}')
+    if args.int8:
+        data_dir = args.data_dir.resolve()
+        if not data_dir.exists():
+            raise SystemExit(f'Dataset not found: {data_dir}. INT8 export needs calibration images.')
+        _, h, w, _ = cnn.inputs[0].shape
+        rep = representative_images(data_dir, (h, w), args.calib_samples)
+        convert_tflite(saved_dir, TFLITE_MODEL_INT8, rep)
+        print(f'INT8 TFLite model exported to: {TFLITE_MODEL_INT8}')
+
+
+if __name__ == '__main__':
+    main()
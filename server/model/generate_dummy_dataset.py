@@ -8,36 +8,71 @@ from __future__ import annotations
 
 from pathlib import Path
 import argparse
+import os
 import random
-from PIL import Image, ImageDraw, ImageFilter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from PIL import Image, ImageFilter
 
 ROOT = Path(__file__).resolve().parents[2]
 DATASET = ROOT / 'dataset'
 
 
+def _draw_rectangle(buf: np.ndarray, x1, y1, x2, y2, color, width=2):
+    box = buf[y1:y2 + 1, x1:x2 + 1]
+    box[:width] = color
+    box[-width:] = color
+    box[:, :width] = color
+    box[:, -width:] = color
+
+
+def _draw_ellipse(buf: np.ndarray, x1, y1, x2, y2, color, width=2):
+    # Outline = pixels inside the outer ellipse but outside the inner one
+    ys, xs = np.ogrid[y1:y2 + 1, x1:x2 + 1]
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    a, b = max((x2 - x1) / 2, 0.5), max((y2 - y1) / 2, 0.5)
+    band = ((xs - cx) / a) ** 2 + ((ys - cy) / b) ** 2 <= 1.0
+    if a > width and b > width:
+        band &= ((xs - cx) / (a - width)) ** 2 + ((ys - cy) / (b - width)) ** 2 > 1.0
+    buf[y1:y2 + 1, x1:x2 + 1][band] = color
+
+
 def make_image(color_bg, color_fg, size=(96, 96)):
     w, h = size
-    img = Image.new('RGB', (w, h), color_bg)
-    draw = ImageDraw.Draw(img)
+    # Draw directly into a uint8 buffer; PIL is only used for the blur and saving
+    buf = np.empty((h, w, 3), dtype=np.uint8)
+    buf[:] = color_bg
     # Draw random circles/rectangles
     for _ in range(5):
         x1, y1 = random.randint(0, w//2), random.randint(0, h//2)
         x2, y2 = random.randint(w//2, w-1), random.randint(h//2, h-1)
         if random.random() < 0.5:
-            draw.ellipse([x1, y1, x2, y2], outline=color_fg, width=2)
+            _draw_ellipse(buf, x1, y1, x2, y2, color_fg)
         else:
-            draw.rectangle([x1, y1, x2, y2], outline=color_fg, width=2)
+            _draw_rectangle(buf, x1, y1, x2, y2, color_fg)
+    img = Image.fromarray(buf)
     # Light blur/noise
     if random.random() < 0.5:
         img = img.filter(ImageFilter.GaussianBlur(radius=0.8))
     return img
 
 
+def _one(i: int, cls_dir: Path, bg, fg, size):
+    # Re-seed from OS entropy: forked workers would otherwise share the parent's RNG state
+    random.seed()
+    img = make_image(bg, fg, size=size)
+    img.save(cls_dir / f"img_{i:03d}.png")
+
+
 def gen_class(cls_dir: Path, color_bg, color_fg, n: int, size):
     cls_dir.mkdir(parents=True, exist_ok=True)
-    for i in range(n):
-        img = make_image(color_bg, color_fg, size=size)
-        img.save(cls_dir / f"img_{i:03d}.png")
+    # Drawing + PNG encoding is independent per image; fan out across cores, in chunks so
+    # large --count values don't pay one IPC round trip per image
+    chunksize = max(1, n // (4 * (os.cpu_count() or 1)))
+    with ProcessPoolExecutor() as ex:
+        list(ex.map(partial(_one, cls_dir=cls_dir, bg=color_bg, fg=color_fg, size=size), range(n),
+                    chunksize=chunksize))
 
 
 def main():
@@ -0,0 +1,55 @@
+"""
+Small Keras model helpers shared by the training scripts and the API.
+
+Kept free of sklearn/matplotlib imports so the server can use them without loading the
+training tool chain.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import tensorflow as tf
+
+
+def has_rescaling(model: tf.keras.Model) -> bool:
+    # True when the model scales raw 0..255 input itself. Normalization layers don't count:
+    # they are typically adapted on already-scaled 0..1 data.
+    return any(isinstance(layer, tf.keras.layers.Rescaling) for layer in model.layers)
+
+
+def build_feature_extractor(cnn_model: tf.keras.Model) -> tf.keras.Model:
+    # Use the penultimate layer (before final Dense) as features
+    # Typically model.layers[-1] is Dense(num_classes) and model.layers[-2] is Dropout or Dense(128)
+    # We want the last Dense(128) output; find the last Dense with units != num_classes
+    # Fallback: use layers[-2]
+    penultimate = None
+    for layer in reversed(cnn_model.layers[:-1]):
+        if isinstance(layer, tf.keras.layers.Dense):
+            # First Dense encountered from the end, skipping the final classification layer
+            penultimate = layer
+            break
+    if penultimate is None:
+        output_tensor = cnn_model.layers[-2].output
+    else:
+        output_tensor = penultimate.output
+    return tf.keras.Model(inputs=cnn_model.input, outputs=output_tensor)
+
+
+def predict_classes(model: tf.keras.Model, ds: tf.data.Dataset) -> tuple[np.ndarray, np.ndarray]:
+    """Return (y_true, y_pred) class ids from a single pass over an (x, y) dataset."""
+    # Forward pass + thresholding/argmax fused into one graph; only class ids leave the device.
+    # The model's head already applies sigmoid/softmax, so its outputs are probabilities.
+    # Labels are kept from the same pass, so the dataset is decoded only once (and shuffling
+    # datasets stay aligned).
+    @tf.function(reduce_retracing=True)
+    def _infer(x):
+        probs = model(x, training=False)
+        if probs.shape[-1] == 1:
+            return tf.cast(tf.squeeze(probs, axis=-1) >= 0.5, tf.int32)
+        return tf.cast(tf.argmax(probs, axis=-1), tf.int32)
+
+    y_true_parts, y_pred_parts = [], []
+    for xb, yb in ds:
+        y_pred_parts.append(_infer(xb).numpy())
+        y_true_parts.append(yb.numpy())
+    return np.concatenate(y_true_parts, axis=0), np.concatenate(y_pred_parts, axis=0)
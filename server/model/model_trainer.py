@@ -8,10 +8,10 @@ Expects a dataset folder with two subfolders:
 
 This script will:
 - Load and split the dataset into training and validation sets
-- Apply on-the-fly data augmentation
+- Apply on-the-fly data augmentation in the input pipeline
 - Build a small CNN model
 - Train with early stopping and checkpointing
-- Save the best model as `mango_model.h5` in this directory
+- Save the best model as `mango_model.keras` in this directory
 - Plot and save training curves to `training_curves.png`
 - Save label mapping to `class_indices.json`
 
@@ -30,7 +30,7 @@ import tensorflow as tf
 
 THIS_DIR = Path(__file__).resolve().parent
 DEFAULT_DATASET_DIR = (THIS_DIR.parent.parent / 'dataset').resolve()
-DEFAULT_OUTPUT_MODEL = (THIS_DIR / 'mango_model.h5').resolve()
+DEFAULT_OUTPUT_MODEL = (THIS_DIR / 'mango_model.keras').resolve()
 DEFAULT_HISTORY_JSON = (THIS_DIR / 'history.json').resolve()
 DEFAULT_TRAINING_PLOT = (THIS_DIR / 'training_curves.png').resolve()
 DEFAULT_LABELS_JSON = (THIS_DIR / 'class_indices.json').resolve()
@@ -42,21 +42,25 @@ def build_argparser() -> argparse.ArgumentParser:
     p.add_argument('--epochs', type=int, default=15, help='Number of training epochs')
     p.add_argument('--batch-size', type=int, default=32, help='Batch size')
     p.add_argument('--img-size', type=int, nargs=2, default=[224, 224], metavar=('H', 'W'), help='Input image size H W')
-    p.add_argument('--output', type=Path, default=DEFAULT_OUTPUT_MODEL, help='Output path for model .h5 file')
+    p.add_argument('--output', type=Path, default=DEFAULT_OUTPUT_MODEL, help='Output path for model .keras file')
     p.add_argument('--seed', type=int, default=123, help='Random seed for split reproducibility')
+    p.add_argument('--precision', choices=['float32', 'mixed_float16', 'mixed_bfloat16'], default='float32',
+                   help='Keras dtype policy; mixed_float16 for GPU, mixed_bfloat16 for TPU/bf16-capable CPUs')
     return p
 
 
-def build_model(input_shape: tuple[int, int, int], num_classes: int) -> tf.keras.Model:
-    data_augmentation = tf.keras.Sequential([
+def build_augmentation() -> tf.keras.Sequential:
+    # Applied in the tf.data pipeline so it runs on CPU, overlapped with training steps
+    return tf.keras.Sequential([
         tf.keras.layers.RandomFlip('horizontal'),
         tf.keras.layers.RandomRotation(0.1),
         tf.keras.layers.RandomZoom(0.1),
     ], name='augmentation')
 
+
+def build_model(input_shape: tuple[int, int, int], num_classes: int) -> tf.keras.Model:
     inputs = tf.keras.Input(shape=input_shape)
     x = tf.keras.layers.Rescaling(1./255)(inputs)
-    x = data_augmentation(x)
 
     # Simple CNN stack
     for filters in (32, 64, 128):
@@ -74,11 +78,11 @@ def build_model(input_shape: tuple[int, int, int], num_classes: int) -> tf.keras
 
     if num_classes == 2:
         # Binary classification head
-        outputs = tf.keras.layers.Dense(1, activation='sigmoid')(x)
+        outputs = tf.keras.layers.Dense(1, activation='sigmoid', dtype='float32')(x)
         loss = 'binary_crossentropy'
         metrics = ['accuracy', tf.keras.metrics.AUC(name='auc')]
     else:
-        outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+        outputs = tf.keras.layers.Dense(num_classes, activation='softmax', dtype='float32')(x)
         loss = 'sparse_categorical_crossentropy'
         metrics = ['accuracy']
 
@@ -122,6 +126,10 @@ def main():
     img_height, img_width = args.img_size
     batch_size = args.batch_size
 
+    # Mixed precision: compile() wraps the optimizer in a LossScaleOptimizer for mixed_float16.
+    # The output head stays float32 for a numerically stable sigmoid/softmax.
+    tf.keras.mixed_precision.set_global_policy(args.precision)
+
     # Use the modern utility which works with nested class subfolders
     train_ds = tf.keras.utils.image_dataset_from_directory(
         data_dir,
@@ -146,10 +154,19 @@ def main():
     num_classes = len(class_names)
     print(f"Classes: {class_names}")
 
-    # Cache and prefetch for performance
+    # Cache, augment in parallel and prefetch for performance
     AUTOTUNE = tf.data.AUTOTUNE
-    train_ds = train_ds.cache().shuffle(1000).prefetch(buffer_size=AUTOTUNE)
+    augmentation = build_augmentation()
+    train_ds = (
+        train_ds.cache()
+        .shuffle(1000, reshuffle_each_iteration=True)
+        .map(lambda x, y: (augmentation(x, training=True), y), num_parallel_calls=AUTOTUNE)
+        .prefetch(buffer_size=AUTOTUNE)
+    )
     val_ds = val_ds.cache().prefetch(buffer_size=AUTOTUNE)
+    if tf.config.list_physical_devices('GPU'):
+        # Overlap host-to-device copies with compute; must be the last transformation
+        train_ds = train_ds.apply(tf.data.experimental.prefetch_to_device('/gpu:0', buffer_size=2))
 
     # Build and train model
     model = build_model((img_height, img_width, 3), num_classes)
@@ -177,8 +194,7 @@ def main():
         callbacks=[ckpt_cb, early_cb, reduce_lr_cb],
     )
 
-    # Save final model too (best already saved by checkpoint)
-    model.save(args.output)
+    # Best model is already saved by the checkpoint (and restored in memory by early stopping)
 
     # Save artifacts
     DEFAULT_LABELS_JSON.write_text(json.dumps({i: name for i, name in enumerate(class_names)}, indent=2))
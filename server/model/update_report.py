@@ -45,10 +45,11 @@ def format_markdown(metrics: dict) -> str:
 
 def update_report(report_path: Path, new_md: str) -> None:
     src = report_path.read_text(encoding='utf-8')
-    if START in src and END in src:
-        prefix, rest = src.split(START, 1)
-        _, suffix = rest.split(END, 1)
-        updated = f"{prefix}{START}\n{new_md}{END}{suffix}"
+    i = src.find(START)
+    j = src.find(END, i + len(START)) if i != -1 else -1
+    if j != -1:
+        # Slice around the marker block once instead of splitting and re-joining the parts
+        updated = f"{src[:i + len(START)]}\n{new_md}{src[j:]}"
     else:
         # If markers missing, append a new section at the end
         updated = src.rstrip() + "\n\n## Auto-generated results\n\n" + START + "\n" + new_md + END + "\n"
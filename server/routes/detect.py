@@ -1,154 +1,525 @@
-from flask import Blueprint, request, jsonify
+import io
+import os
+
+# Per-worker CPU threading, configured before TensorFlow is imported so the runtime picks it up.
+# With N gunicorn workers, each uses TF_INTRA threads; launch about cores / TF_INTRA workers.
+TF_INTRA = int(os.environ.get('TF_INTRA', '2'))
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+os.environ.setdefault('OMP_NUM_THREADS', str(TF_INTRA))
+os.environ.setdefault('KMP_BLOCKTIME', '0')
+# Coalesce concurrent requests into one batched forward pass (useful with threaded workers)
+BATCHING_ENABLED = os.environ.get('BATCHING_ENABLED', '0') == '1'
+
+from flask import Blueprint, Response, request
 from PIL import Image
 import numpy as np
 import tensorflow as tf
 from pathlib import Path
 import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 import joblib
+import orjson
+
+from model.keras_utils import build_feature_extractor, has_rescaling
+
+tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA)
+tf.config.threading.set_inter_op_parallelism_threads(1)
+
+_LOG = logging.getLogger(__name__)
 
 
 # Blueprint for detection routes
 detect_bp = Blueprint('detect', __name__)
+
+
+def _json(payload, status: int = 200) -> Response:
+    """JSON response via orjson; NumPy scalars and arrays serialize without conversion."""
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+                    status=status, mimetype='application/json')
+
+
+def _mtime_ns(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _conditional(tag: str, build) -> Response:
+    """Answer 304 if the client already holds this weak ETag, else build() the response.
+
+    Successful responses carry the ETag and a short revalidation window for polling clients.
+    """
+    if request.if_none_match.contains_weak(tag):
+        resp = Response(status=304)
+    else:
+        resp = build()
+    if resp.status_code in (200, 304):
+        resp.set_etag(tag, weak=True)
+        resp.headers['Cache-Control'] = 'max-age=5, must-revalidate'
+    return resp
+
+
 @detect_bp.route('/health', methods=['GET'])
 def health():
     """Lightweight health endpoint to verify API is reachable and model presence."""
-    model_path = (_model_dir() / 'mango_model.h5')
-    best = _get_best_model_name()
-    return jsonify({
+    # A loaded model answers without touching the filesystem; only probe files before the first load
+    model_present = (MODEL is not None or _tflite_path() is not None
+                     or _current_export(_SAVED_PB) or _cnn_model_path().exists())
+    tag = f'{_mtime_ns(_BEST_JSON) or 0}-{int(model_present)}'
+    return _conditional(tag, lambda: _json({
         'status': 'ok',
-        'model_present': model_path.exists(),
-        'best_model': best,
-    })
+        'model_present': model_present,
+        'best_model': _get_best_model_name(),
+    }))
 
 
 
 # Globals for lazy-loaded model and metadata
-MODEL = None
-FEATURE_EXTRACTOR = None
+MODEL = None  # Keras model, loaded SavedModel, or TFLite interpreter
+MODEL_FN = None  # np.ndarray batch -> np.ndarray class probabilities
+MODEL_MULTI = None  # Keras model with [MODEL.output, penultimate output]
+MULTI_FN = None  # np.ndarray batch -> (class probabilities, penultimate features), one forward pass
 SVM_MODEL = None
 RF_MODEL = None
 INPUT_SIZE = (224, 224)
-CLASS_NAMES = None  # List[str]
-
-
-def _model_dir() -> Path:
-    return Path(__file__).resolve().parent.parent / 'model'
+NEEDS_SCALE = False  # True when MODEL has no Rescaling layer and expects 0..1 input
+INPUT_DTYPE = np.float32  # np.uint8 for INT8-quantized TFLite models
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+CLASS_NAMES = None  # tuple[str, ...]
+_TLS = threading.local()  # per-thread reusable input buffer
+# Parsed metadata JSON, reused until the file's mtime changes
+_COMP_CACHE = {'mtime': 0, 'data': None}
+_BEST_CACHE = {'mtime': 0, 'data': None}
+# Runs the SVM and RF heads side by side; sklearn releases the GIL in its C kernels
+_CLF_POOL = ThreadPoolExecutor(max_workers=2)
+_BATCHER = None  # _MicroBatcher around the current inference function, when BATCHING_ENABLED
+_BATCHER_LOCK = threading.Lock()
+_INFER_LOCK = threading.Lock()  # serializes unbatched forward passes within a worker
+
+
+# Model artifact paths, resolved once at import
+_MODEL_DIR = Path(__file__).resolve().parent.parent / 'model'
+_KERAS_PATH = _MODEL_DIR / 'mango_model.keras'
+_LEGACY_H5_PATH = _MODEL_DIR / 'mango_model.h5'
+_SAVED_DIR = _MODEL_DIR / 'mango_saved'  # model/export_model.py; preferred over the Keras file
+_SAVED_PB = _SAVED_DIR / 'saved_model.pb'
+_TFLITE_PATH = _MODEL_DIR / 'mango_model.tflite'
+_TFLITE_INT8_PATH = _MODEL_DIR / 'mango_model_int8.tflite'
+_COMP_JSON = _MODEL_DIR / 'metrics' / 'model_comparison.json'
+_BEST_JSON = _MODEL_DIR / 'best_model.json'
+_SVM_PATH = _MODEL_DIR / 'models' / 'svm.pkl'
+_RF_PATH = _MODEL_DIR / 'models' / 'rf.pkl'
+
+
+def _cnn_model_path() -> Path:
+    # Native .keras format; fall back to a legacy HDF5 model trained before the switch
+    if not _KERAS_PATH.exists() and _LEGACY_H5_PATH.exists():
+        return _LEGACY_H5_PATH
+    return _KERAS_PATH
+
+
+def _current_export(path: Path, warn: bool = False) -> bool:
+    """True if an export exists and is not older than the Keras model it was made from."""
+    export_mtime = _mtime_ns(path)
+    if export_mtime is None:
+        return False
+    keras_path = _cnn_model_path()
+    keras_mtime = _mtime_ns(keras_path)
+    if keras_mtime is not None and export_mtime < keras_mtime:
+        if warn:
+            _LOG.warning('Ignoring %s: older than %s. Re-run model/export_model.py.', path.name, keras_path.name)
+        return False
+    return True
+
+
+def _tflite_path(warn: bool = False) -> Path | None:
+    # TFLite exports (model/export_model.py --tflite/--int8); preferred for CPU inference,
+    # INT8-quantized over float. Exports older than the retrained Keras model are skipped.
+    for path in (_TFLITE_INT8_PATH, _TFLITE_PATH):
+        if _current_export(path, warn):
+            return path
+    return None
 
 
-def _load_labels(model_dir: Path) -> list[str] | None:
+def _load_labels(model_dir: Path) -> tuple[str, ...]:
     labels_file = model_dir / 'class_indices.json'
     if labels_file.exists():
         try:
             mapping = json.loads(labels_file.read_text())
-            # mapping is index -> name
-            items = sorted(((int(k), v) for k, v in mapping.items()), key=lambda kv: kv[0])
-            return [name for _, name in items]
+            # mapping is index -> name with dense indices 0..n-1, so place each name directly
+            labels = [None] * len(mapping)
+            for k, v in mapping.items():
+                labels[int(k)] = v
+            return tuple(labels)
         except Exception:
             pass
     # Fallback order
-    return ['organic', 'pesticide']
+    return ('organic', 'pesticide')
 
 
-def _comparison_json_path() -> Path:
-    return _model_dir() / 'metrics' / 'model_comparison.json'
+def _cached_json(path: Path, cache: dict):
+    """Parse a JSON file, reusing the previous result while its mtime is unchanged."""
+    mtime = path.stat().st_mtime_ns  # raises FileNotFoundError if missing
+    if cache['data'] is None or cache['mtime'] != mtime:
+        cache['data'] = json.loads(path.read_text())
+        cache['mtime'] = mtime
+    return cache['data']
 
 
-def _best_model_json_path() -> Path:
-    return _model_dir() / 'best_model.json'
+def _get_comparison() -> dict | None:
+    try:
+        return _cached_json(_COMP_JSON, _COMP_CACHE)
+    except Exception:
+        return None
 
 
 def _get_best_model_name() -> str | None:
-    p = _best_model_json_path()
-    if p.exists():
-        try:
-            data = json.loads(p.read_text())
-            return data.get('best_model')
-        except Exception:
+    try:
+        return _cached_json(_BEST_JSON, _BEST_CACHE).get('best_model')
+    except Exception:
+        return None
+
+
+def _traced_fn(model: tf.keras.Model):
+    """Wrap a model in a traced graph (any batch size) and warm it so the trace isn't paid on a request."""
+    traced = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[tf.TensorSpec([None, INPUT_SIZE[0], INPUT_SIZE[1], 3], tf.float32)],
+    )
+
+    def fn(x: np.ndarray):
+        out = traced(tf.constant(x))
+        if isinstance(out, (list, tuple)):
+            return tuple(t.numpy() for t in out)
+        return out.numpy()
+    fn(np.zeros([1, INPUT_SIZE[0], INPUT_SIZE[1], 3], np.float32))
+    return fn
+
+
+def _signature_fn(signature, *keys: str):
+    """Adapt a SavedModel signature (dict output) to the same call style as _traced_fn."""
+    def fn(x: np.ndarray):
+        out = signature(x=tf.constant(x))
+        if len(keys) > 1:
+            return tuple(out[k].numpy() for k in keys)
+        return out[keys[0]].numpy()
+    fn(np.zeros([1, INPUT_SIZE[0], INPUT_SIZE[1], 3], np.float32))
+    return fn
+
+
+def _tflite_fns(interpreter: tf.lite.Interpreter):
+    """Adapt a TFLite interpreter's 'multi' signature to the same call style as _traced_fn.
+
+    Returns (probs_fn, multi_fn); both share one lock since interpreters are not thread-safe.
+    """
+    runner = interpreter.get_signature_runner('multi')
+    idetail = interpreter.get_input_details()[0]
+    dtype = idetail['dtype']
+    scale, zero_point = idetail['quantization']
+    # INT8 models take raw pixels as-is only when calibration landed on scale=1, zero_point=0;
+    # otherwise quantize 0..255 pixels with the input tensor's parameters
+    quantize = np.issubdtype(dtype, np.integer) and scale != 0 and (scale, zero_point) != (1.0, 0)
+    if quantize:
+        info = np.iinfo(dtype)
+    lock = threading.Lock()
+
+    def prepare(x: np.ndarray) -> np.ndarray:
+        if quantize:
+            q = np.round(x.astype(np.float32) / scale + zero_point)
+            return np.clip(q, info.min, info.max).astype(dtype)
+        return x.astype(dtype, copy=False)
+
+    def multi_fn(x: np.ndarray):
+        x = prepare(x)
+        with lock:
+            out = runner(x=x)
+        return out['probs'], out['features']
+
+    def fn(x: np.ndarray) -> np.ndarray:
+        return multi_fn(x)[0]
+    multi_fn(np.zeros([1, INPUT_SIZE[0], INPUT_SIZE[1], 3], dtype))
+    return fn, multi_fn
+
+
+class _MicroBatcher:
+    """Runs concurrent single-image calls of fn as one batched call on a background thread.
+
+    A batch closes at max_batch images or max_wait_ms after its first image arrives.
+    """
+
+    def __init__(self, fn, max_batch: int = 8, max_wait_ms: float = 5.0):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.buf = None  # [max_batch, H, W, 3] input, reused across batches
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def __call__(self, x: np.ndarray):
+        fut = Future()
+        self.queue.put((x, fut))
+        return fut.result()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
             return None
-    return None
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # finish this batch, then stop
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+            # Any failure is handed to the waiting callers; the thread must stay alive
+            try:
+                self._run_batch(items)
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _run_batch(self, items):
+        x0 = items[0][0]
+        if self.buf is None or self.buf.shape[1:] != x0.shape[1:] or self.buf.dtype != x0.dtype:
+            self.buf = np.empty((self.max_batch,) + x0.shape[1:], dtype=x0.dtype)
+        for i, (x, _) in enumerate(items):
+            self.buf[i] = x[0]
+        out = self.fn(self.buf[:len(items)])
+        # Hand each caller its own [1, ...] slice of every output
+        for i, (_, fut) in enumerate(items):
+            if isinstance(out, tuple):
+                fut.set_result(tuple(o[i:i + 1] for o in out))
+            else:
+                fut.set_result(out[i:i + 1])
+
+
+def _batched(fn):
+    """Route calls to fn through the shared micro-batcher, replacing it after a model reload."""
+    global _BATCHER
+    with _BATCHER_LOCK:
+        if _BATCHER is None or _BATCHER.fn is not fn:
+            if _BATCHER is not None:
+                _BATCHER.stop()
+            _BATCHER = _MicroBatcher(fn)
+        return _BATCHER
 
 
 def _load_model():
-    global MODEL, INPUT_SIZE, CLASS_NAMES
+    global MODEL, MODEL_FN, MULTI_FN, INPUT_SIZE, NEEDS_SCALE, INPUT_DTYPE, CLASS_NAMES
     if MODEL is not None:
         return
-    model_dir = _model_dir()
-    model_path = model_dir / 'mango_model.h5'
+    # MODEL is published last, once its inference functions are built, so a failed load
+    # is retried on the next request instead of leaving MODEL set without MODEL_FN
+    tflite_path = _tflite_path(warn=True)
+    if tflite_path is not None:
+        # Lean CPU runtime; input scaling is baked into the exported graph
+        model = tf.lite.Interpreter(model_path=str(tflite_path), num_threads=TF_INTRA)
+        idetail = model.get_input_details()[0]
+        INPUT_SIZE = (int(idetail['shape'][1]), int(idetail['shape'][2]))
+        NEEDS_SCALE = False
+        # Integer models get raw uint8 pixels, quantized to the input tensor in _tflite_fns
+        INPUT_DTYPE = np.uint8 if np.issubdtype(idetail['dtype'], np.integer) else np.float32
+        MODEL_FN, MULTI_FN = _tflite_fns(model)
+        CLASS_NAMES = _load_labels(_MODEL_DIR)
+        MODEL = model
+        return
+    if _current_export(_SAVED_PB, warn=True):
+        # Graph-mode SavedModel: call its concrete signatures directly; input scaling is baked in
+        model = tf.saved_model.load(str(_SAVED_DIR))
+        serve = model.signatures['serving_default']
+        ispec = next(iter(serve.structured_input_signature[1].values()))
+        INPUT_SIZE = (int(ispec.shape[1]), int(ispec.shape[2]))
+        NEEDS_SCALE = False
+        MODEL_FN = _signature_fn(serve, 'probs')
+        MULTI_FN = _signature_fn(model.signatures['multi'], 'probs', 'features')
+        CLASS_NAMES = _load_labels(_MODEL_DIR)
+        MODEL = model
+        return
+    model_path = _cnn_model_path()
     if not model_path.exists():
         raise FileNotFoundError(f"Model not found at {model_path}. Train and save the model first.")
-    MODEL = tf.keras.models.load_model(str(model_path), compile=False)
+    model = tf.keras.models.load_model(str(model_path), compile=False)
     # Infer input size from model input tensor
     try:
-        ishape = MODEL.inputs[0].shape
+        ishape = model.inputs[0].shape
         h = int(ishape[1]) if ishape[1] is not None else 224
         w = int(ishape[2]) if ishape[2] is not None else 224
         INPUT_SIZE = (h, w)
     except Exception:
         INPUT_SIZE = (224, 224)
-    CLASS_NAMES = _load_labels(model_dir)
+    # Decided once per model instead of scanning every request's pixels
+    NEEDS_SCALE = not has_rescaling(model)
+    MODEL_FN = _traced_fn(model)
+    CLASS_NAMES = _load_labels(_MODEL_DIR)
+    MODEL = model
 
 
-def _load_feature_models():
-    """Lazy-load feature extractor and sklearn models if present."""
-    global FEATURE_EXTRACTOR, SVM_MODEL, RF_MODEL
-    if FEATURE_EXTRACTOR is None and MODEL is not None:
-        # Penultimate layer features
-        try:
-            # Try to pick the last Dense layer output as features
-            penultimate = None
-            for layer in reversed(MODEL.layers):
-                if isinstance(layer, tf.keras.layers.Dense):
-                    penultimate = layer
-                    break
-            output_tensor = penultimate.output if penultimate is not None else MODEL.layers[-2].output
-            FEATURE_EXTRACTOR = tf.keras.Model(inputs=MODEL.input, outputs=output_tensor)
-        except Exception:
-            FEATURE_EXTRACTOR = None
-    models_dir = _model_dir() / 'models'
-    svm_path = models_dir / 'svm.pkl'
-    rf_path = models_dir / 'rf.pkl'
-    if SVM_MODEL is None and svm_path.exists():
+def _prefetch(path: Path) -> None:
+    """Ask the kernel to start reading a model file into the page cache ahead of loading it."""
+    if not hasattr(os, 'posix_fadvise'):  # not available on Windows
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
         try:
-            SVM_MODEL = joblib.load(svm_path)
-        except Exception:
-            SVM_MODEL = None
-    if RF_MODEL is None and rf_path.exists():
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def _feature_width() -> int | None:
+    """Width of the penultimate features MULTI_FN produces, or None without a feature output."""
+    if MULTI_FN is None:
+        return None
+    _, feats = MULTI_FN(np.zeros((1, INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=INPUT_DTYPE))
+    return int(feats.shape[-1])
+
+
+def _load_head(path: Path, n_features: int | None):
+    """Load an SVM/RF head; None if it can't be read or was fitted on different features."""
+    _prefetch(path)
+    try:
+        # Read-only memory map: arrays are paged in from the (shared) page cache instead of copied
+        clf = joblib.load(path, mmap_mode='r')
+    except Exception:
+        _LOG.exception('Failed to load %s', path.name)
+        return None
+    n_in = getattr(clf, 'n_features_in_', None)
+    if n_features is not None and n_in is not None and n_in != n_features:
+        _LOG.warning('Not loading %s: fitted on %d features but the CNN produces %d. '
+                     'Re-run model/compare_models.py.', path.name, n_in, n_features)
+        return None
+    return clf
+
+
+def _load_feature_models():
+    """Lazy-load the combined CNN/feature model and sklearn models if present."""
+    global MODEL_MULTI, MULTI_FN, SVM_MODEL, RF_MODEL
+    # TFLite and SavedModel exports already carry a combined 'multi' signature
+    if MULTI_FN is None and isinstance(MODEL, tf.keras.Model):
+        # Expose the penultimate layer as a second output of MODEL, so one forward pass
+        # yields both the CNN probabilities and the SVM/RF features
+        # (same layer compare_models.py trained the SVM/RF on)
         try:
-            RF_MODEL = joblib.load(rf_path)
+            feat_extractor = build_feature_extractor(MODEL)
+            MODEL_MULTI = tf.keras.Model(inputs=MODEL.input, outputs=[MODEL.output, feat_extractor.output])
+            MULTI_FN = _traced_fn(MODEL_MULTI)
         except Exception:
-            RF_MODEL = None
+            MODEL_MULTI = None
+            MULTI_FN = None
+    load_svm = SVM_MODEL is None and _SVM_PATH.exists()
+    load_rf = RF_MODEL is None and _RF_PATH.exists()
+    if not (load_svm or load_rf):
+        return
+    n_features = _feature_width()
+    if load_svm:
+        SVM_MODEL = _load_head(_SVM_PATH, n_features)
+    if load_rf:
+        RF_MODEL = _load_head(_RF_PATH, n_features)
+        # Trained with n_jobs=-1; for one sample per request a joblib fan-out is pure overhead
+        if RF_MODEL is not None and hasattr(RF_MODEL, 'n_jobs'):
+            RF_MODEL.n_jobs = 1
 
 
 def _reset_models():
     """Reset cached models and metadata so they can be reloaded from disk."""
-    global MODEL, FEATURE_EXTRACTOR, SVM_MODEL, RF_MODEL, INPUT_SIZE, CLASS_NAMES
+    global MODEL, MODEL_FN, MODEL_MULTI, MULTI_FN, SVM_MODEL, RF_MODEL
+    global INPUT_SIZE, NEEDS_SCALE, INPUT_DTYPE, CLASS_NAMES
     MODEL = None
-    FEATURE_EXTRACTOR = None
+    MODEL_FN = None
+    MODEL_MULTI = None
+    MULTI_FN = None
     SVM_MODEL = None
     RF_MODEL = None
     INPUT_SIZE = (224, 224)
+    NEEDS_SCALE = False
+    INPUT_DTYPE = np.float32
     CLASS_NAMES = None
+    _COMP_CACHE.update(mtime=0, data=None)
+    _BEST_CACHE.update(mtime=0, data=None)
 
 
-def _preprocess_image(file_storage) -> np.ndarray:
-    # Open with PIL, convert to RGB, resize to model input
-    img = Image.open(file_storage.stream).convert('RGB')
-    img = img.resize((INPUT_SIZE[1], INPUT_SIZE[0]))  # (width, height)
-    x = np.array(img, dtype=np.float32)
-    # If model includes Rescaling layer, values can be 0..255; model handles scaling.
-    # To be robust, normalize only when values appear unscaled.
-    if x.max() > 1.5:
-        x = x / 255.0
-    x = np.expand_dims(x, axis=0)
-    return x
+def _warm_models():
+    """Run one dummy image through every loaded model so kernel selection and the sklearn
+    heads' first-call setup happen before real traffic."""
+    x = np.zeros((1, INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=INPUT_DTYPE)
+    if MULTI_FN is None:
+        MODEL_FN(x)
+        return
+    _, feats = MULTI_FN(x)
+    for clf in (SVM_MODEL, RF_MODEL):
+        if clf is not None:
+            _classify(clf, feats)
+
+
+def init_app(app):
+    """Load and warm all models at startup instead of on the first request."""
+    try:
+        _load_model()
+        _load_feature_models()
+        _warm_models()
+    except FileNotFoundError as e:
+        # No trained model yet; routes keep loading lazily once one is saved
+        app.logger.warning('Models not preloaded: %s', e)
+    except Exception:
+        # Never block the workers from booting; requests retry the load and report the error
+        app.logger.exception('Model preload failed')
+
+
+def _input_buffer() -> np.ndarray:
+    """Reusable [1, H, W, 3] input buffer, one per thread so concurrent requests don't share it."""
+    buf = getattr(_TLS, 'buf', None)
+    if buf is None or buf.shape[1:3] != INPUT_SIZE or buf.dtype != INPUT_DTYPE:
+        buf = _TLS.buf = np.empty((1, INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=INPUT_DTYPE)
+    return buf
+
+
+def _read_upload(file_storage) -> bytes | None:
+    """Read the uploaded file once into memory; None if it exceeds MAX_UPLOAD_BYTES."""
+    raw_bytes = file_storage.read(MAX_UPLOAD_BYTES + 1)
+    return raw_bytes if len(raw_bytes) <= MAX_UPLOAD_BYTES else None
+
 
+def _preprocess_once(raw_bytes: bytes) -> np.ndarray:
+    """Decode and resize the upload once; returns a [1, H, W, 3] batch ready for MODEL.
 
-def _preprocess_raw_image(file_storage) -> np.ndarray:
-    """Preprocess without manual scaling (for feature extractor that includes rescaling)."""
-    img = Image.open(file_storage.stream).convert('RGB')
-    img = img.resize((INPUT_SIZE[1], INPUT_SIZE[0]))
-    x = np.array(img, dtype=np.float32)  # 0..255
-    x = np.expand_dims(x, axis=0)
+    float32 (0..255, or 0..1 when NEEDS_SCALE) for float models; raw uint8 for INT8 models.
+    """
+    # Open with PIL, convert to RGB, resize to model input (bilinear, as in training)
+    img = Image.open(io.BytesIO(raw_bytes)).convert('RGB')
+    img = img.resize((INPUT_SIZE[1], INPUT_SIZE[0]), Image.BILINEAR)  # (width, height)
+    arr = np.asarray(img, dtype=np.uint8)
+    # Convert straight into the reused buffer. Models with a Rescaling layer take 0..255
+    # input; only scale for models without one.
+    x = _input_buffer()
+    if NEEDS_SCALE:
+        np.multiply(arr, np.float32(1.0 / 255.0), out=x[0], casting='unsafe')
+    else:
+        np.copyto(x[0], arr, casting='unsafe')
     return x
 
 
@@ -174,7 +545,29 @@ def _validate_mango_image(cnn_conf, svm_conf, rf_conf, threshold=0.50):
     return True, "Valid mango image"
 
 
-def _compare_on_image(file_storage):
+def _pct(x: float) -> float:
+    """Probability in [0, 1] as a percentage rounded to 2 decimals."""
+    return int(x * 10000.0 + 0.5) / 100.0
+
+
+def _classify(clf, feats: np.ndarray):
+    """Run one sklearn head on the feature vector; returns (label, confidence) or (None, None)."""
+    try:
+        if hasattr(clf, 'predict_proba'):
+            proba = clf.predict_proba(feats)[0]
+            idx = int(np.argmax(proba))
+            conf = float(proba[idx])
+        else:
+            idx = int(clf.predict(feats)[0])
+            conf = 1.0
+        label = CLASS_NAMES[idx] if CLASS_NAMES and idx < len(CLASS_NAMES) else str(idx)
+        return label, conf
+    except Exception:
+        _LOG.exception('%s prediction failed', type(clf).__name__)
+        return None, None
+
+
+def _compare_on_image(raw_bytes: bytes):
     """Shared logic: run CNN, SVM, RF on an image, choose model by validation accuracy or per-image confidence.
     Returns dict: { models: {cnn|svm|random_forest: {label, confidence%}}, selection: {model, reason, detail}, final: {label, confidence%} }
     """
@@ -182,47 +575,36 @@ def _compare_on_image(file_storage):
     _load_model()
     _load_feature_models()
 
-    # CNN prediction (scaled input for robustness)
-    x_scaled = _preprocess_image(file_storage)
-    preds = MODEL.predict(x_scaled, verbose=0)
+    # Single decode shared by the CNN and the feature-based models
+    x = _preprocess_once(raw_bytes)
+
+    # CNN prediction and penultimate features from the same forward pass. Decoding above is
+    # memory-bound and runs concurrently across requests; the compute-bound forward pass runs
+    # one at a time so it gets all TF_INTRA threads (batched with other requests when enabled)
+    infer = MULTI_FN if MULTI_FN is not None else MODEL_FN
+    if BATCHING_ENABLED:
+        out = _batched(infer)(x)  # the batcher thread already runs one pass at a time
+    else:
+        with _INFER_LOCK:
+            out = infer(x)
+    preds, feats = out if MULTI_FN is not None else (out, None)
+
+    # Feature-based predictions; SVM and RF run concurrently while the CNN result is decoded below
+    svm_future = _CLF_POOL.submit(_classify, SVM_MODEL, feats) if feats is not None and SVM_MODEL is not None else None
+    rf_future = _CLF_POOL.submit(_classify, RF_MODEL, feats) if feats is not None and RF_MODEL is not None else None
+
     if preds.shape[-1] == 1:
         p1 = float(preds[0][0])
         cnn_idx = 1 if p1 >= 0.5 else 0
         cnn_conf = p1 if cnn_idx == 1 else (1.0 - p1)
     else:
-        probs = tf.nn.softmax(preds[0]).numpy().tolist()
-        cnn_idx = int(np.argmax(probs))
-        cnn_conf = float(probs[cnn_idx])
+        # The head already applies softmax; read the winning probability directly
+        cnn_idx = int(preds[0].argmax())
+        cnn_conf = float(preds[0][cnn_idx])
     cnn_label = CLASS_NAMES[cnn_idx] if CLASS_NAMES and cnn_idx < len(CLASS_NAMES) else str(cnn_idx)
 
-    # Feature-based predictions
-    xr = _preprocess_raw_image(file_storage)
-    feats = FEATURE_EXTRACTOR.predict(xr, verbose=0) if FEATURE_EXTRACTOR is not None else None
-    svm_label = svm_conf = rf_label = rf_conf = None
-    if feats is not None and SVM_MODEL is not None:
-        try:
-            if hasattr(SVM_MODEL, 'predict_proba'):
-                proba = SVM_MODEL.predict_proba(feats)[0]
-                si = int(np.argmax(proba))
-                svm_conf = float(proba[si])
-            else:
-                si = int(SVM_MODEL.predict(feats)[0])
-                svm_conf = 1.0
-            svm_label = CLASS_NAMES[si] if CLASS_NAMES and si < len(CLASS_NAMES) else str(si)
-        except Exception:
-            svm_label = svm_conf = None
-    if feats is not None and RF_MODEL is not None:
-        try:
-            if hasattr(RF_MODEL, 'predict_proba'):
-                proba = RF_MODEL.predict_proba(feats)[0]
-                ri = int(np.argmax(proba))
-                rf_conf = float(proba[ri])
-            else:
-                ri = int(RF_MODEL.predict(feats)[0])
-                rf_conf = 1.0
-            rf_label = CLASS_NAMES[ri] if CLASS_NAMES and ri < len(CLASS_NAMES) else str(ri)
-        except Exception:
-            rf_label = rf_conf = None
+    svm_label, svm_conf = svm_future.result() if svm_future is not None else (None, None)
+    rf_label, rf_conf = rf_future.result() if rf_future is not None else (None, None)
 
     # Validate if this is a mango image
     is_valid, validation_msg = _validate_mango_image(cnn_conf, svm_conf, rf_conf)
@@ -230,21 +612,20 @@ def _compare_on_image(file_storage):
         return {'error': validation_msg, 'is_mango': False}
 
     models = {
-        'cnn': {'label': cnn_label, 'confidence': round(cnn_conf * 100.0, 2)},
+        'cnn': {'label': cnn_label, 'confidence': _pct(cnn_conf)},
     }
     if svm_label is not None and svm_conf is not None:
-        models['svm'] = {'label': svm_label, 'confidence': round(svm_conf * 100.0, 2)}
+        models['svm'] = {'label': svm_label, 'confidence': _pct(svm_conf)}
     if rf_label is not None and rf_conf is not None:
-        models['random_forest'] = {'label': rf_label, 'confidence': round(rf_conf * 100.0, 2)}
+        models['random_forest'] = {'label': rf_label, 'confidence': _pct(rf_conf)}
 
     # Decide selection: prefer highest validation accuracy
     reason = ''
     best_model = 'cnn'
     accs = {'cnn': None, 'svm': None, 'random_forest': None}
-    comp_path = _comparison_json_path()
-    if comp_path.exists():
+    comp = _get_comparison()
+    if comp is not None:
         try:
-            comp = json.loads(comp_path.read_text())
             accs['cnn'] = float(comp['models'].get('cnn', {}).get('accuracy', 0.0))
             accs['svm'] = float(comp['models'].get('svm', {}).get('accuracy', 0.0))
             accs['random_forest'] = float(comp['models'].get('random_forest', {}).get('accuracy', 0.0))
@@ -276,12 +657,15 @@ def _compare_on_image(file_storage):
 def detect():
     try:
         if 'image' not in request.files:
-            return jsonify({'error': 'no image provided'}), 400
-        res = _compare_on_image(request.files['image'])
+            return _json({'error': 'no image provided'}, 400)
+        raw_bytes = _read_upload(request.files['image'])
+        if raw_bytes is None:
+            return _json({'error': 'image too large (max 10 MB)'}, 413)
+        res = _compare_on_image(raw_bytes)
         
         # Check if image was rejected as non-mango
         if 'error' in res and 'is_mango' in res:
-            return jsonify(res), 400
+            return _json(res, 400)
         
         # Keep backward compatibility: return label/confidence, plus model_used
         final = res.get('final') or {}
@@ -293,23 +677,26 @@ def detect():
         # Also include full comparison so the frontend can show charts without re-upload
         payload['models'] = res.get('models')
         payload['selection'] = res.get('selection')
-        return jsonify(payload)
+        return _json(payload)
     except FileNotFoundError as e:
-        return jsonify({'error': str(e)}), 500
+        return _json({'error': str(e)}, 500)
     except Exception as e:
-        return jsonify({'error': f'prediction failed: {str(e)}'}), 500
+        return _json({'error': f'prediction failed: {str(e)}'}, 500)
 
 
 @detect_bp.route('/models/comparison', methods=['GET'])
 def models_comparison():
-    p = _comparison_json_path()
-    if not p.exists():
-        return jsonify({'error': 'comparison metrics not found. Run compare_models.py first.'}), 404
-    try:
-        data = json.loads(p.read_text())
-        return jsonify(data)
-    except Exception as e:
-        return jsonify({'error': f'failed to read comparison metrics: {str(e)}'}), 500
+    p = _COMP_JSON
+    mtime = _mtime_ns(p)
+    if mtime is None:
+        return _json({'error': 'comparison metrics not found. Run compare_models.py first.'}, 404)
+
+    def build():
+        try:
+            return _json(_cached_json(p, _COMP_CACHE))
+        except Exception as e:
+            return _json({'error': f'failed to read comparison metrics: {str(e)}'}, 500)
+    return _conditional(str(mtime), build)
 
 
 @detect_bp.route('/reload', methods=['POST'])
@@ -319,17 +706,17 @@ def reload_models():
         _reset_models()
         _load_model()  # load CNN
         _load_feature_models()  # load feature extractor + sklearn models
-        models_dir = _model_dir() / 'models'
-        return jsonify({
+        _warm_models()
+        return _json({
             'status': 'reloaded',
             'model_present': True,
-            'svm_present': (models_dir / 'svm.pkl').exists(),
-            'rf_present': (models_dir / 'rf.pkl').exists(),
+            'svm_present': _SVM_PATH.exists(),
+            'rf_present': _RF_PATH.exists(),
         })
     except FileNotFoundError as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+        return _json({'status': 'error', 'error': str(e)}, 500)
     except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+        return _json({'status': 'error', 'error': str(e)}, 500)
 
 
 @detect_bp.route('/compare-image', methods=['POST'])
@@ -340,13 +727,16 @@ def compare_image():
     """
     try:
         if 'image' not in request.files:
-            return jsonify({'error': 'no image provided'}), 400
-        res = _compare_on_image(request.files['image'])
+            return _json({'error': 'no image provided'}, 400)
+        raw_bytes = _read_upload(request.files['image'])
+        if raw_bytes is None:
+            return _json({'error': 'image too large (max 10 MB)'}, 413)
+        res = _compare_on_image(raw_bytes)
         
         # Check if image was rejected as non-mango
         if 'error' in res and 'is_mango' in res:
-            return jsonify(res), 400
+            return _json(res, 400)
             
-        return jsonify(res)
+        return _json(res)
     except Exception as e:
-        return jsonify({'error': f'compare failed: {str(e)}'}), 500
+        return _json({'error': f'compare failed: {str(e)}'}, 500)